@@ -1,9 +1,19 @@
-import sys, socket, json, time 
-from select import select
-from collections import defaultdict, namedtuple
-from threading import Thread, Timer
+import sys, socket, asyncio, json
+import orjson
+from collections import defaultdict, namedtuple, deque
 from datetime import datetime
-from copy import deepcopy
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 SIZE = 4096
 
@@ -18,108 +28,496 @@ CLOSE         = "close"
 COSTSUPDATE   = "costsupdate"
 SHOWNEIGHBORS = "neighbors"
 
-class RepeatTimer(Thread):
-    """ thread that will call a function every interval seconds """
-    def __init__(self, interval, target):
-        Thread.__init__(self)
-        self.target = target
-        self.interval = interval
-        self.daemon = True
-        self.stopped = False
-    def run(self):
-        while not self.stopped:
-            time.sleep(self.interval)
-            self.target()
-
-class ResettableTimer():
-    def __init__(self, interval, func, args=None):
-        if args != None: assert type(args) is list
-        self.interval = interval
-        self.func = func
-        self.args = args
-        self.countdown = self.create_timer()
-    def start(self):
-        self.countdown.start()
-    def reset(self):
-        self.countdown.cancel()
-        self.countdown = self.create_timer()
-        self.start()
-    def create_timer(self):
-        t = Timer(self.interval, self.func, self.args)
-        t.daemon = True
-        return t
-    def cancel(self):
-        self.countdown.cancel()
-
-def estimate_costs():
-    """ recalculate inter-node path costs using bellman ford algorithm """
-    for destination_addr, destination in nodes.items():
+class CostTable():
+    """ structure-of-arrays mirror of the link costs held in nodes. each
+        address gets a stable index i: direct[i] is our link cost if it's a
+        neighbor, and ncost[i, j] the cost neighbor i advertises to node j.
+        arrays double in size when they run out of room """
+    def __init__(self, capacity=16):
+        self.addr_index = {}
+        self.addrs = []
+        self.direct = np.full(capacity, np.inf)
+        self.ncost  = np.full((capacity, capacity), np.inf)
+    def index(self, addr):
+        """ index of addr, registering it if we haven't seen it before """
+        i = self.addr_index.get(addr)
+        if i is None:
+            i = self.addr_index[addr] = len(self.addrs)
+            self.addrs.append(addr)
+            if i == len(self.direct):
+                self.grow()
+        return i
+    def grow(self):
+        n = len(self.direct)
+        direct = np.full(2*n, np.inf)
+        ncost = np.full((2*n, 2*n), np.inf)
+        direct[:n], ncost[:n, :n] = self.direct, self.ncost
+        self.direct, self.ncost = direct, ncost
+    def set_direct(self, addr, direct):
+        self.direct[self.index(addr)] = direct
+    def set_costs(self, addr, costs):
+        """ replace neighbor addr's row with the costs it just advertised """
+        i = self.index(addr)
+        # index every destination first since registering may grow the arrays
+        columns = [self.index(dest) for dest in costs]
+        self.ncost[i, :] = np.inf
+        self.ncost[i, columns] = np.fromiter(costs.values(), float, len(costs))
+
+def relax_python(destinations, active_neighbors):
+    """ cheapest (cost, nexthop) to each destination, without numpy """
+    inf = float("inf")
+    best_cost = dict.fromkeys(destinations, inf)
+    best_route = dict.fromkeys(destinations, '')
+    for neighbor_addr, neighbor in active_neighbors:
+        # look the neighbor's fields up once for the whole destination sweep
+        direct = neighbor['direct']
+        get = neighbor['costs'].get
+        for destination_addr in destinations:
+            # skip destinations the neighbor has no (or a poisoned) route to
+            neighbor_cost = get(destination_addr)
+            if neighbor_cost is None or neighbor_cost == inf:
+                continue
+            # distance = direct cost to neighbor + cost from neighbor to destination
+            dist = direct + neighbor_cost
+            # strictly cheaper only, so the first cheapest neighbor wins ties
+            if dist < best_cost[destination_addr]:
+                best_cost[destination_addr] = dist
+                best_route[destination_addr] = neighbor_addr
+    return [(best_cost[addr], best_route[addr]) for addr in destinations]
+
+def relax_kernel(direct, ncost, neighbor_idx, dest_idx):
+    """ cheapest cost and neighbor index to each destination in dest_idx,
+        written as plain loops so numba can compile it """
+    best_cost = np.full(len(dest_idx), np.inf)
+    best_neighbor = np.full(len(dest_idx), -1)
+    for j in range(len(dest_idx)):
+        dest = dest_idx[j]
+        for k in range(len(neighbor_idx)):
+            neighbor = neighbor_idx[k]
+            dist = direct[neighbor] + ncost[neighbor, dest]
+            # strictly cheaper only, so the first cheapest neighbor wins ties
+            if dist < best_cost[j]:
+                best_cost[j] = dist
+                best_neighbor[j] = neighbor
+    return best_cost, best_neighbor
+
+if njit is not None:
+    # every fast-math flag except nnan/ninf: unreachable costs are infinite
+    relax_kernel = njit(cache=True, fastmath={'nsz', 'arcp', 'contract', 'afn', 'reassoc'})(relax_kernel)
+
+def relax_vectorized(table, destinations, active_neighbors):
+    """ cheapest (cost, nexthop) to each destination over the neighbor rows
+        of the cost table, compiled with numba when available and otherwise
+        as a single numpy reduction """
+    # look up indexes before touching the arrays, registering may grow them
+    neighbor_idx = np.array([table.index(addr) for addr, _ in active_neighbors], dtype=np.intp)
+    dest_idx = np.array([table.index(addr) for addr in destinations], dtype=np.intp)
+    if njit is not None:
+        cost, route_idx = relax_kernel(table.direct, table.ncost, neighbor_idx, dest_idx)
+    elif not len(neighbor_idx):
+        cost = np.full(len(dest_idx), np.inf)
+        route_idx = np.full(len(dest_idx), -1)
+    else:
+        # candidate[k, j] = direct cost to neighbor k + its cost to destination j
+        candidate = table.direct[neighbor_idx, None] + table.ncost[np.ix_(neighbor_idx, dest_idx)]
+        # argmin keeps the first cheapest neighbor, same tie-break as relax_python
+        best = candidate.argmin(axis=0)
+        cost = candidate[best, np.arange(len(dest_idx))]
+        route_idx = neighbor_idx[best]
+    return [(c, table.addrs[r] if c != float("inf") else '')
+            for c, r in zip(cost.tolist(), route_idx.tolist())]
+
+class BFNode():
+    """ one node in the network: its routing state, socket and timers.
+        nothing is shared between instances, so several nodes can run in
+        one process, each on its own thread """
+    def __init__(self, host, port, run_args):
+        # peers key us by the address our datagrams come from, so that is the
+        # name we go by too, and loopback or our own hostname are mapped onto it
+        self.ip = get_host(host, local_ip([h for h, _, _ in run_args.neighbors]))
+        self.me = addr2key(self.ip, port)
+        self.run_args = run_args
+        self.sock = setup_server(host, port)
+        # one event loop drives the socket, the broadcast and the silence
+        # timers; uvloop's is a drop-in, faster implementation. otherwise ask
+        # for a selector loop, windows' default proactor loop has no add_reader
+        self.loop = uvloop.new_event_loop() if uvloop is not None else asyncio.SelectorEventLoop()
+        # pending linkdown for each neighbor, pushed back whenever it talks
+        self.silence_handles = {}
+        # every datagram is read into the same buffer, then parsed straight out of it
+        self.view = memoryview(bytearray(SIZE))
+        # packed copy of node costs, only kept when numpy is available
+        self.table = CostTable() if np is not None else None
+        # neighbors whose distance vectors changed and still need relaxing
+        self.relax_queue = deque()
+        self.in_queue = set()
+        # set when a neighbor is queued; relaxation is deferred until it is needed
+        self.dirty = False
+        # our advertised cost to every node, patched as estimates change
+        self.cost_snapshot = {}
+        # serialized broadcast payloads keyed by (poisoned destinations, direct cost),
+        # valid only while costs_version matches the version they were built at
+        self.dumps_cache = {}
+        self.costs_version = 0
+        self.cached_version = None
+        # (payload, sendto_addr) for each neighbor from the last full broadcast,
+        # resent as is while no route, cost or direct link cost has changed
+        self.sent = []
+        self.sent_version = None
+        # inter-node protocol messages and the methods that handle them
+        self.updates = {
+            LINKDOWN    : self.linkdown,
+            LINKUP      : self.linkup,
+            LINKCHANGE  : self.linkchange,
+            COSTSUPDATE : self.update_costs,
+        }
+        # the subset of nodes with a live link, kept in step with is_neighbor
+        # and in the same order as nodes
+        self.neighbors = {}
+        self.nodes = { self.me: self.create_node(cost=0.0, is_neighbor=False) }
+
+    def add_neighbor(self, host, port, direct):
+        """ link to a neighbor given on the command line """
+        addr = addr2key(get_host(host, self.ip), port)
+        self.nodes[addr] = self.create_node(
+                cost        = direct,
+                is_neighbor = True,
+                direct      = direct,
+                costs       = { addr: 0.0 },
+                addr        = addr)
+        self.enqueue(addr)
+
+    def reset_silence_monitor(self, addr):
+        """ take neighbor down unless it sends another update within 3 timeouts """
+        self.cancel_silence_monitor(addr)
+        self.silence_handles[addr] = self.loop.call_later(
+                3*self.run_args.timeout, self.linkdown, *key2addr(addr))
+
+    def cancel_silence_monitor(self, addr):
+        handle = self.silence_handles.pop(addr, None)
+        if handle is not None:
+            handle.cancel()
+
+    def bump_version(self):
+        """ invalidate cached broadcast payloads """
+        self.costs_version += 1
+
+    def estimate_costs(self, destinations=None):
+        """ recalculate inter-node path costs using bellman ford algorithm;
+            returns whether any cost or route changed """
+        if destinations is None:
+            destinations = list(self.nodes)
         # we don't need to update the distance to ourselves
-        if destination_addr != me:
-            # iterate through neighbors and find cheapest route
-            cost = float("inf")
-            nexthop = ''
-            for neighbor_addr, neighbor in get_neighbors().items():
-                # distance = direct cost to neighbor + cost from neighbor to destination
-                if destination_addr in neighbor['costs']:
-                    dist = neighbor['direct'] + neighbor['costs'][destination_addr]
-                    if dist < cost:
-                        cost = dist
-                        nexthop = neighbor_addr
+        destinations = [addr for addr in destinations if addr != self.me]
+        # neighbors behind a downed link can't offer a route, so drop them up front
+        active_neighbors = [(neighbor_addr, neighbor)
+                            for neighbor_addr, neighbor in self.neighbors.items()
+                            if neighbor['direct'] != float("inf")]
+        if self.table is not None:
+            estimates = relax_vectorized(self.table, destinations, active_neighbors)
+        else:
+            estimates = relax_python(destinations, active_neighbors)
+        changed = False
+        for destination_addr, (cost, nexthop) in zip(destinations, estimates):
+            destination = self.nodes[destination_addr]
             # set new estimated cost to node in the network
+            if cost != destination['cost'] or nexthop != destination['route']:
+                self.cost_snapshot[destination_addr] = cost
+                self.bump_version()
+                changed = True
             destination['cost'] = cost
             destination['route'] = nexthop
+        return changed
 
-def update_costs(host, port, **kwargs):
-    """ update neighbor's costs """
-    costs = kwargs['costs']
-    addr = addr2key(host, port)
-    # if a node listed in costs is not in our list of nodes...
-    for node in costs:
-        if node not in nodes:
-            # ... create a new node
-            nodes[node] = default_node()
-    # if node not a neighbor ...
-    if not nodes[addr]['is_neighbor']: 
-        # ... make it your neighbor!
-        print('making new neighbor {0}\n'.format(addr))
-        del nodes[addr]
-        nodes[addr] = create_node(
-                cost        = nodes[addr]['cost'], 
-                is_neighbor = True,
-                direct      = kwargs['neighbor']['direct'],
-                costs       = costs,
-                addr        = addr)
-    else:
-        # otherwise just update node costs
-        node = nodes[addr]
-        node['costs'] = costs
-        # restart silence monitor
-        node['silence_monitor'].reset()
-    # run bellman ford
-    estimate_costs()
-
-def broadcast_costs():
-    """ send estimated path costs to each neighbor """
-    costs = { addr: node['cost'] for addr, node in nodes.items() }
-    data = { 'type': COSTSUPDATE }
-    for neighbor_addr, neighbor in get_neighbors().items():
-        # poison reverse!!! muhuhhahaha
-        poisoned_costs = deepcopy(costs)
-        for dest_addr, cost in costs.items():
-            # only do poisoned reverse if destination not me or neighbor
-            if dest_addr not in [me, neighbor_addr]:
-                # if we route through neighbor to get to destination ...
-                if nodes[dest_addr]['route'] == neighbor_addr:
-                    # ... tell neighbor distance to destination is infinty!
-                    poisoned_costs[dest_addr] = float("inf")
-        data['payload'] = { 'costs': poisoned_costs }
-        data['payload']['neighbor'] = { 'direct': neighbor['direct'] }
-        # send (potentially 'poisoned') costs to neighbor
-        sock.sendto(json.dumps(data), key2addr(neighbor_addr))
+    def enqueue(self, addr):
+        """ mark a neighbor's distance vector as needing relaxation """
+        self.dirty = True
+        if addr not in self.in_queue:
+            self.in_queue.add(addr)
+            self.relax_queue.append(addr)
+
+    def spfa_relax(self):
+        """ re-run bellman ford only for destinations affected by queued neighbors """
+        affected = set()
+        while self.relax_queue:
+            addr = self.relax_queue.popleft()
+            self.in_queue.discard(addr)
+            # anything the neighbor advertises may now be cheaper through it ...
+            affected.update(self.nodes[addr].get('costs', ()))
+            # ... and anything we currently route through it may have gotten worse
+            affected.update(dest for dest, node in self.nodes.items() if node['route'] == addr)
+        return self.estimate_costs(affected)
+
+    def relax_if_dirty(self):
+        """ run any relaxation deferred since the last one, just once;
+            returns whether it changed any cost or route """
+        if not self.dirty:
+            return False
+        self.dirty = False
+        return self.spfa_relax()
+
+    def update_costs(self, host, port, **kwargs):
+        """ update neighbor's costs """
+        # orjson encodes infinity as null, so turn those back into infinity
+        costs = { dest: cost if cost is not None else float("inf")
+                  for dest, cost in kwargs['costs'].items() }
+        addr = addr2key(get_host(host, self.ip), port)
+        # if a node listed in costs is not in our list of nodes...
+        for node in costs:
+            if node not in self.nodes:
+                # ... create a new node
+                self.nodes[node] = default_node()
+                self.bump_version()
+        # the sender may not list itself under the name we know it by, but
+        # it is always zero away from itself
+        costs[addr] = 0.0
+        if addr not in self.nodes:
+            self.nodes[addr] = default_node()
+            self.bump_version()
+        # if node not a neighbor ...
+        if not self.nodes[addr]['is_neighbor']:
+            # ... make it your neighbor!
+            print('making new neighbor {0}\n'.format(addr))
+            cost = self.nodes.pop(addr)['cost']
+            self.nodes[addr] = self.create_node(
+                    cost        = cost,
+                    is_neighbor = True,
+                    direct      = kwargs['neighbor']['direct'],
+                    costs       = costs,
+                    addr        = addr)
+        else:
+            # otherwise just update node costs
+            node = self.nodes[addr]
+            node['costs'] = costs
+            if self.table is not None:
+                self.table.set_costs(addr, costs)
+            # restart silence monitor
+            self.reset_silence_monitor(addr)
+        # rerun bellman-ford for this neighbor before the next broadcast
+        self.enqueue(addr)
+
+    def advertised_costs(self):
+        """ our cost to every node, plus the destinations grouped by the
+            neighbor we route through to reach them """
+        # nodes can be added without a relaxation (e.g. ourselves at startup),
+        # so rebuild the snapshot if it no longer covers every node
+        if len(self.cost_snapshot) != len(self.nodes):
+            self.cost_snapshot.clear()
+            self.cost_snapshot.update((addr, node['cost']) for addr, node in self.nodes.items())
+        costs = self.cost_snapshot
+        # never poison the route to ourselves or to the neighbor itself
+        routed_through = defaultdict(list)
+        for dest_addr, node in self.nodes.items():
+            if dest_addr not in [self.me, node['route']]:
+                routed_through[node['route']].append(dest_addr)
+        return costs, routed_through
+
+    def broadcast_costs(self):
+        """ send estimated path costs to each neighbor """
+        # fold every update received since the last tick into one recompute
+        self.relax_if_dirty()
+        # nothing moved since the last broadcast, so resend the same datagrams.
+        # they can't be skipped: neighbors' silence monitors wait on them
+        if self.sent_version == self.costs_version:
+            for payload, sendto_addr in self.sent:
+                self.sock.sendto(payload, sendto_addr)
+            return
+        if self.cached_version != self.costs_version:
+            self.dumps_cache.clear()
+            self.cached_version = self.costs_version
+        costs, routed_through = self.advertised_costs()
+        data = { 'type': COSTSUPDATE }
+        sent = []
+        for neighbor_addr, neighbor in self.neighbors.items():
+            # poison reverse!!! muhuhhahaha
+            # if we route through neighbor to get to destination, tell neighbor
+            # distance to destination is infinity, then restore the real costs
+            poisoned = routed_through[neighbor_addr]
+            # neighbors sharing a poison pattern and link cost get identical bytes
+            key = (frozenset(poisoned), neighbor['direct'])
+            payload = self.dumps_cache.get(key)
+            if payload is None:
+                for dest_addr in poisoned:
+                    costs[dest_addr] = float("inf")
+                data['payload'] = { 'costs': costs }
+                data['payload']['neighbor'] = { 'direct': neighbor['direct'] }
+                payload = self.dumps_cache[key] = orjson.dumps(data)
+                for dest_addr in poisoned:
+                    costs[dest_addr] = self.nodes[dest_addr]['cost']
+            # send (potentially 'poisoned') costs to neighbor
+            self.sock.sendto(payload, neighbor['sendto_addr'])
+            sent.append((payload, neighbor['sendto_addr']))
+        self.sent = sent
+        self.sent_version = self.costs_version
+
+    def create_node(self, cost, is_neighbor, direct=None, costs=None, addr=None):
+        """ centralizes the pattern for creating new nodes """
+        node = default_node()
+        node['cost'] = cost
+        node['is_neighbor'] = is_neighbor
+        node['direct'] = direct if direct != None else float("inf")
+        node['costs']  = costs  if costs  != None else {}
+        if is_neighbor:
+            self.neighbors[addr] = node
+            self.bump_version()
+            node['route'] = addr
+            node['sendto_addr'] = key2addr(addr)
+            if self.table is not None:
+                self.table.set_direct(addr, node['direct'])
+                self.table.set_costs(addr, node['costs'])
+            # ensure neighbor is transmitting cost updates
+            self.reset_silence_monitor(addr)
+        return node
+
+    def get_node(self, host, port):
+        """ returns formatted address and node info for that addr """
+        error = False
+        addr = addr2key(get_host(host, self.ip), port)
+        if addr not in self.nodes:
+            error = 'node not in network'
+        node = self.nodes.get(addr)
+        return node, addr, error
+
+    def linkchange(self, host, port, **kwargs):
+        node, addr, err = self.get_node(host, port)
+        if err: return
+        if not node['is_neighbor']:
+            print("node {0} is not a neighbor so the link cost can't be changed\n".format(addr))
+            return
+        direct = kwargs['direct']
+        if direct < 1:
+            print("the minimum amount a link cost between nodes can be is 1")
+            return
+        if 'saved' in node:
+            print("this link currently down. please first bring link back to life using LINKUP cmd.")
+            return
+        node['direct'] = direct
+        if self.table is not None:
+            self.table.set_direct(addr, node['direct'])
+        self.bump_version()
+        # rerun bellman-ford for this neighbor before the next broadcast
+        self.enqueue(addr)
+
+    def linkdown(self, host, port, **kwargs):
+        node, addr, err = self.get_node(host, port)
+        if err: return
+        if not node['is_neighbor']:
+            print("node {0} is not a neighbor so it can't be taken down\n".format(addr))
+            return
+        # save direct distance to neighbor, then set to infinity
+        node['saved'] = node['direct']
+        node['direct'] = float("inf")
+        if self.table is not None:
+            self.table.set_direct(addr, node['direct'])
+        node['is_neighbor'] = False
+        del self.neighbors[addr]
+        self.cancel_silence_monitor(addr)
+        self.bump_version()
+        # rerun bellman-ford for this neighbor before the next broadcast
+        self.enqueue(addr)
+
+    def linkup(self, host, port, **kwargs):
+        node, addr, err = self.get_node(host, port)
+        if err: return
+        # make sure node was previously taken down via LINKDOWN cmd
+        if 'saved' not in node:
+            print("{0} wasn't a previous neighbor\n".format(addr))
+            return
+        # restore saved direct distance
+        node['direct'] = node['saved']
+        if self.table is not None:
+            self.table.set_direct(addr, node['direct'])
+        del node['saved']
+        node['is_neighbor'] = True
+        # rebuild rather than append, so neighbors stays in nodes order and the
+        # first cheapest neighbor still wins ties the same way it always has
+        self.neighbors = { neighbor_addr: neighbor for neighbor_addr, neighbor in self.nodes.items()
+                           if neighbor['is_neighbor'] }
+        self.bump_version()
+        # rerun bellman-ford for this neighbor before the next broadcast
+        self.enqueue(addr)
+
+    def show_neighbors(self):
+        """ show active neighbors """
+        self.relax_if_dirty()
+        print(formatted_now())
+        print("Neighbors: ")
+        for addr, neighbor in self.neighbors.items():
+            print("{addr}, cost:{cost}, direct:{direct}".format(
+                    addr   = addr,
+                    cost   = neighbor['cost'],
+                    direct = neighbor['direct']))
+        print() # extra line
+
+    def showrt(self):
+        """ display routing info: cost to destination; route to take """
+        self.relax_if_dirty()
+        print(formatted_now())
+        print("Distance vector list is:")
+        for addr, node in self.nodes.items():
+            if addr != self.me:
+                print("Destination = {destination}, "
+                       "Cost = {cost}, "
+                       "Link = ({nexthop})".format(
+                            destination = addr,
+                            cost        = node['cost'],
+                            nexthop     = node['route']))
+        print() # extra line
+
+    def handle_message(self, data, address):
+        """ dispatch an inter-node protocol message to its handler """
+        handler = self.updates.get(data.get('type'))
+        if handler is None:
+            print("unknown message type from {0}: {1}\n".format(address, data.get('type')))
+            return
+        handler(*address, **data.get('payload', {}))
+
+    def broadcast_and_reschedule(self):
+        # schedule the next tick first so a failed send can't stop broadcasting
+        self.loop.call_later(self.run_args.timeout, self.broadcast_and_reschedule)
+        self.broadcast_costs()
+
+    def read_datagrams(self):
+        """ handle every datagram waiting on the socket """
+        while True:
+            try:
+                nbytes, address = self.sock.recvfrom_into(self.view)
+            except BlockingIOError:
+                return
+            # handle data
+            try:
+                data = orjson.loads(self.view[:nbytes])
+            except ValueError:
+                # older peers send infinity as the non-standard Infinity literal,
+                # which orjson rejects but the stdlib parser accepts
+                try:
+                    data = json.loads(bytes(self.view[:nbytes]))
+                except ValueError as err:
+                    print("Error decoding json: {0}".format(err))
+                    continue
+            self.handle_message(data, address)
+
+    def serve(self):
+        """ broadcast on a timer and handle incoming updates until interrupted """
+        self.loop.add_reader(self.sock, self.read_datagrams)
+        self.loop.call_later(self.run_args.timeout, self.broadcast_and_reschedule)
+        print("waiting for incoming data\n")
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            print("Server shutting down...\n")
+        finally:
+            self.loop.remove_reader(self.sock)
+            self.loop.close()
+            self.sock.close()
 
 def setup_server(host, port):
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # the event loop drains the socket until it would block
+    if hasattr(socket, 'SOCK_NONBLOCK'):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM | socket.SOCK_NONBLOCK)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
     try:
         sock.bind((host, port))
         print("listening on {0}:{1}\n".format(host, port))
@@ -129,143 +527,79 @@ def setup_server(host, port):
         sys.exit(1)
     return sock
 
+def addr2key(host, port):
+    """ 'host:port' string used to key nodes """
+    return "{0}:{1}".format(host, port)
+
+def key2addr(key):
+    """ (host, port) tuple back from a node key """
+    host, port = key.rsplit(':', 1)
+    return host, int(port)
+
+def get_host(host, local):
+    """ resolve host to an ip; '', loopback and this machine's own hostname all
+        mean this machine, which goes by local """
+    ip = socket.gethostbyname(host or 'localhost')
+    if ip.startswith('127.') or ip == '0.0.0.0' or host == socket.gethostname():
+        return local
+    return ip
+
+def local_ip(peers=()):
+    """ the address this machine sends from on the way to peers, found by
+        connecting a udp socket (which sends nothing) and reading its name """
+    for host in list(peers) + ['10.255.255.255']:
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            probe.connect((socket.gethostbyname(host), 1))
+            ip = probe.getsockname()[0]
+        except OSError:
+            continue
+        finally:
+            probe.close()
+        # a loopback peer tells us nothing about how other machines see us
+        if not ip.startswith('127.'):
+            return ip
+    return '127.0.0.1'
+
 def default_node():
     return { 'cost': float("inf"), 'is_neighbor': False, 'route': '' }
 
-def create_node(cost, is_neighbor, direct=None, costs=None, addr=None):
-    """ centralizes the pattern for creating new nodes """
-    node = default_node()
-    node['cost'] = cost
-    node['is_neighbor'] = is_neighbor
-    node['direct'] = direct if direct != None else float("inf")
-    node['costs']  = costs  if costs  != None else defaultdict(lambda: float("inf"))
-    if is_neighbor:
-        node['route'] = addr
-        # ensure neighbor is transmitting cost updates using a resettable timer
-        monitor = ResettableTimer(
-            interval = 3*run_args.timeout, 
-            func = linkdown,
-            args = list(key2addr(addr)))
-        monitor.start()
-        node['silence_monitor'] = monitor
-    return node
-
-def get_node(host, port):
-    """ returns formatted address and node info for that addr """
-    error = False
-    addr = addr2key(get_host(host), port)
-    if not in_network(addr):
-        error = 'node not in network'
-    node = nodes[addr]
-    return node, addr, error
-
-def linkchange(host, port, **kwargs):
-    node, addr, err = get_node(host, port)
-    if err: return
-    if not node['is_neighbor']: 
-        print("node {0} is not a neighbor so the link cost can't be changed\n".format(addr))
-        return
-    direct = kwargs['direct']
-    if direct < 1:
-        print("the minimum amount a link cost between nodes can be is 1")
-        return
-    if 'saved' in node:
-        print("this link currently down. please first bring link back to life using LINKUP cmd.")
-        return
-    node['direct'] = direct
-    # run bellman-ford
-    estimate_costs()
-
-def linkdown(host, port, **kwargs):
-    node, addr, err = get_node(host, port)
-    if err: return
-    if not node['is_neighbor']: 
-        print("node {0} is not a neighbor so it can't be taken down\n".format(addr))
-        return
-    # save direct distance to neighbor, then set to infinity
-    node['saved'] = node['direct']
-    node['direct'] = float("inf")
-    node['is_neighbor'] = False
-    node['silence_monitor'].cancel()
-    # run bellman-ford
-    estimate_costs()
-
-def linkup(host, port, **kwargs):
-    node, addr, err = get_node(host, port)
-    if err: return
-    # make sure node was previously taken down via LINKDOWN cmd
-    if 'saved' not in node:
-        print("{0} wasn't a previous neighbor\n".format(addr))
-        return
-    # restore saved direct distance
-    node['direct'] = node['saved']
-    del node['saved']
-    node['is_neighbor'] = True
-    # run bellman-ford
-    estimate_costs()
-
 def formatted_now():
     return datetime.now().strftime("%b-%d-%Y, %I:%M %p, %S seconds")
 
-def show_neighbors():
-    """ show active neighbors """
-    print(formatted_now())
-    print("Neighbors: ")
-    for addr, neighbor in get_neighbors().items():
-        print("{addr}, cost:{cost}, direct:{direct}".format(
-                addr   = addr, 
-                cost   = neighbor['cost'],
-                direct = neighbor['direct']))
-    print() # extra line
-
-def showrt():
-    """ display routing info: cost to destination; route to take """
-    print(formatted_now())
-    print("Distance vector list is:")
-    for addr, node in nodes.items():
-        if addr != me:
-            print("Destination = {destination}, "
-                   "Cost = {cost}, "
-                   "Link = ({nexthop})".format(
-                        destination = addr,
-                        cost        = node['cost'],
-                        nexthop     = node['route']))
-    print() # extra line
-
 def close():
     """ notify all neighbors that she's a comin daaaahwn! then close process"""
     ''' I am commenting out the code that instantly notifies neighbors that the link
         is being closed because requirements say a 'close' cmd "is like simulating link failure"
     data = {'type': LINKDOWN}
-    for neighbor in get_neighbors().values():
-        addr = key2addr(neighbor)
-        sock.sendto(json.dumps(data), addr)
+    for neighbor in node.neighbors.values():
+        sock.sendto(orjson.dumps(data), neighbor['sendto_addr'])
     print("done notifying neighbors\n") '''
     sys.exit()
 
-def run_server():
-    global nodes
-    args = ('localhost', 1234)  # Replace with the desired host and port
-    sock = setup_server(*args)
-    print("waiting for incoming data\n")
+RunArgs = namedtuple('RunArgs', ['port', 'timeout', 'neighbors'])
+
+def parse_argv(argv):
+    """ bfclient.py <listening-port> <timeout> <ip-address1 port1 distance1> ... """
+    usage = "usage: python bfclient.py <listening-port> <timeout> <ip-address1 port1 distance1> ..."
+    if len(argv) < 3 or (len(argv) - 3) % 3 != 0:
+        print(usage)
+        sys.exit(1)
     try:
-        while True:
-            read_sockets, write_sockets, error_sockets = select([sock], [], [], 3)
-            # if no packets arrive, keep going without blocking
-            if not read_sockets:
-                continue
-            for s in read_sockets:
-                data, address = s.recvfrom(SIZE)
-                # handle data
-                try:
-                    data = json.loads(data)
-                except ValueError as err:
-                    print("Error decoding json: {0}".format(err))
-                    break
-                handle_message(data, address)
-    except KeyboardInterrupt:
-        print("Server shutting down...\n")
-    finally:
-        sock.close()
-        
-run_server()
\ No newline at end of file
+        port, timeout = int(argv[1]), float(argv[2])
+        neighbors = [(argv[i], int(argv[i+1]), float(argv[i+2]))
+                     for i in range(3, len(argv), 3)]
+    except ValueError:
+        print(usage)
+        sys.exit(1)
+    return RunArgs(port, timeout, neighbors)
+
+def run_server(run_args):
+    # listen on every interface so neighbors on other machines can reach us
+    node = BFNode('', run_args.port, run_args)
+    for host, port, direct in run_args.neighbors:
+        node.add_neighbor(host, port, direct)
+    node.serve()
+
+if __name__ == '__main__':
+    run_server(parse_argv(sys.argv))
@@ -0,0 +1,105 @@
+import random
+import select
+import socket
+
+import pytest
+
+import bfclient
+from bfclient import BFNode, RunArgs
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('', 0))
+        return sock.getsockname()[1]
+
+
+def make_node(port, neighbors):
+    node = BFNode('', port, RunArgs(port, 1.0, neighbors))
+    for host, neighbor_port, direct in neighbors:
+        node.add_neighbor(host, neighbor_port, direct)
+    return node
+
+
+def deliver(sender, receiver):
+    sender.broadcast_costs()
+    assert select.select([receiver.sock], [], [], 1.0)[0]
+    receiver.read_datagrams()
+
+
+def test_two_node_exchange_keeps_link_cost():
+    a_port, b_port = free_port(), free_port()
+    # one side names the other by interface address, the other by loopback
+    a = make_node(a_port, [(bfclient.local_ip(), b_port, 4.0)])
+    b = make_node(b_port, [('localhost', a_port, 4.0)])
+    try:
+        for _ in range(2):
+            deliver(a, b)
+            deliver(b, a)
+        # each side knows the other by the name it advertises itself under
+        assert set(a.nodes) == set(b.nodes) == {a.me, b.me}
+        assert a.nodes[b.me]['cost'] == b.nodes[a.me]['cost'] == 4.0
+        assert a.nodes[b.me]['route'] == b.me
+        # loopback senders are the same node as the configured neighbor
+        b.update_costs('127.0.0.1', a_port, costs={a.me: 0.0, b.me: 4.0},
+                       neighbor={'direct': 4.0})
+        b.relax_if_dirty()
+        assert set(b.nodes) == {a.me, b.me}
+        assert b.nodes[a.me]['cost'] == 4.0
+    finally:
+        for node in (a, b):
+            node.sock.close()
+            node.loop.close()
+
+
+def test_update_from_unlisted_sender_makes_it_a_neighbor():
+    port = free_port()
+    node = make_node(port, [])
+    try:
+        node.update_costs('10.0.0.2', 20001, costs={'127.0.0.1:20001': 0.0, node.me: 3.0},
+                          neighbor={'direct': 3.0})
+        node.relax_if_dirty()
+        assert node.nodes['10.0.0.2:20001']['is_neighbor']
+        assert node.nodes['10.0.0.2:20001']['cost'] == 3.0
+    finally:
+        node.sock.close()
+        node.loop.close()
+
+
+def relax_graph(seed=0, n_neighbors=12, n_destinations=24):
+    """ neighbors with small integer costs, so ties are common, and some
+        missing or poisoned entries; more nodes than a fresh table holds """
+    rng = random.Random(seed)
+    inf = float("inf")
+    destinations = ['10.0.0.{0}:20000'.format(i) for i in range(n_destinations)]
+    neighbors = []
+    for addr in destinations[:n_neighbors]:
+        costs = {}
+        for dest in destinations:
+            pick = rng.random()
+            if pick < 0.2:
+                continue
+            costs[dest] = inf if pick < 0.3 else float(rng.randint(0, 3))
+        neighbors.append((addr, {'direct': float(rng.randint(1, 3)), 'costs': costs}))
+    return destinations, neighbors
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_relax_backends_agree(monkeypatch, seed):
+    pytest.importorskip('numpy')
+    destinations, neighbors = relax_graph(seed)
+    expected = bfclient.relax_python(destinations, neighbors)
+
+    def vectorized():
+        table = bfclient.CostTable()
+        for addr, neighbor in neighbors:
+            table.set_direct(addr, neighbor['direct'])
+            table.set_costs(addr, neighbor['costs'])
+        return bfclient.relax_vectorized(table, destinations, neighbors)
+
+    # the compiled kernel, or the same loops uncompiled when numba is missing
+    monkeypatch.setattr(bfclient, 'njit', bfclient.njit or (lambda f: f))
+    assert vectorized() == expected
+    # the numpy argmin reduction
+    monkeypatch.setattr(bfclient, 'njit', None)
+    assert vectorized() == expected